@@ -9,7 +9,7 @@
 #     "14.0903" -> "14.0903"
 # - Uses NCES searchresults.aspx to locate the cipdetail link for the EXACT CIP row
 #   (supports 2-digit/4-digit rollups like "14" or "14.09")
-# - Fetches + parses those detail pages (best-effort)
+# - Fetches (concurrently, under a shared rate limit) + parses those detail pages (best-effort)
 # - Appends truly missing records into data/processed/nces_cip2020.json
 #
 # Key Fix:
@@ -20,15 +20,21 @@
 
 from __future__ import annotations
 
-import json
 import re
-import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from operator import itemgetter
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from urllib.parse import urljoin, urlparse, parse_qs
 
-import requests
-from bs4 import BeautifulSoup
+import lxml.html
+import orjson
+from lxml import etree
+
+from cip_codec import CANON_CIP_RE, canonical_cip
+from http_fetch import RateLimiter, fetch_cached
+from json_io import write_json
 
 
 BASE = "https://nces.ed.gov/ipeds/cipcode/"
@@ -37,136 +43,97 @@ SEARCHRESULTS_URL = (
     "?y=56&aw={cip}&sw=1,2,3&ct=1,2,3&ca=1,2,5,3,4"
 )
 
+# Concurrent fetches share one global rate limit (~5 requests/sec) to stay polite
+FETCH_WORKERS = 8
+REQUEST_INTERVAL = 0.20
+
 # Matches detail header like: "Detail for CIP Code 14.0903"
 CIP_CAPTURE_RE = re.compile(r"Detail for CIP Code\s+(\d{2}(?:\.\d{1,4})?)")
 
+# Section labels on cipdetail pages (each also ends the section before it)
+SECTION_LABELS = ["Title:", "Definition:", "Action:", "Illustrative Examples", "Crosswalk", "Browse", "Print"]
+SECTION_LABEL_RE = re.compile("|".join(re.escape(label) for label in SECTION_LABELS))
 
-def normalize_spaces(s: str) -> str:
-    return re.sub(r"\s+", " ", (s or "")).strip()
-
-
-def canonical_cip(cip: str) -> str:
-    """
-    Convert NCES/DHS CIP variants into a canonical format:
-    - 2-digit: "14"      -> "14.0000"
-    - 4-digit: "14.09"   -> "14.0900"
-    - 6-digit: "14.0903" -> "14.0903"
-    Also strips brackets/parentheses sometimes used for moved/deleted codes.
-    """
-    s = (cip or "").strip()
-    if not s:
-        return ""
+# Non-empty lines of rendered page text
+TEXT_LINE_RE = re.compile(r"[^\n]+")
 
-    s = s.strip("[]()")
-    s = s.replace(" ", "")
-
-    # 2-digit family
-    if "." not in s:
-        if len(s) == 2 and s.isdigit():
-            return f"{s}.0000"
-        return s
-
-    left, right = s.split(".", 1)
-    left = left.strip()
-    right = right.strip()
-
-    if not (len(left) == 2 and left.isdigit()):
-        return s
-
-    # rollup like 14.09
-    if len(right) == 2 and right.isdigit():
-        return f"{left}.{right}00"
-
-    # program code like 14.0903
-    if len(right) == 4 and right.isdigit():
-        return f"{left}.{right}"
+# searchresults.aspx grid rows, plus the CIP cell and detail link within a row (compiled once)
+SEARCH_GRID_ROWS_XPATH = etree.XPath("//table[contains(@id, 'GridView_searchresults')]//tr")
+ROW_CIP_XPATH = etree.XPath(".//td[contains(concat(' ', normalize-space(@class), ' '), ' cipcode ')]")
+ROW_TITLE_HREF_XPATH = etree.XPath(
+    ".//span[contains(concat(' ', normalize-space(@class), ' '), ' CIPTitle ')]//a/@href"
+)
 
-    # any other numeric right side: pad to 4
-    if right.isdigit() and 1 <= len(right) <= 4:
-        return f"{left}.{right.zfill(4)}"
 
-    return s
+def normalize_spaces(s: str) -> str:
+    return " ".join(s.split()) if s else ""
 
 
 def load_json(path: Path) -> Any:
-    return json.loads(path.read_text(encoding="utf-8"))
+    return orjson.loads(path.read_bytes())
 
 
-def write_json(path: Path, obj: Any) -> None:
-    path.write_text(json.dumps(obj, indent=2), encoding="utf-8")
+def find_section_boundaries(page_text: str) -> List[Tuple[int, str]]:
+    return [(m.start(), m.group()) for m in SECTION_LABEL_RE.finditer(page_text)]
 
 
-def extract_section_text(page_text: str, label: str) -> str:
-    labels = ["Title:", "Definition:", "Action:", "Illustrative Examples", "Crosswalk", "Browse", "Print"]
+def extract_section_text(page_text: str, boundaries: List[Tuple[int, str]], label: str) -> str:
+    markers = iter(boundaries)
 
-    start = page_text.find(label)
-    if start < 0:
+    for pos, name in markers:
+        if name == label:
+            start = pos + len(label)
+            break
+    else:
         return ""
 
-    start += len(label)
-
-    candidates: List[int] = []
-    for nxt in labels:
-        if nxt == label:
-            continue
-        pos = page_text.find(nxt, start)
-        if pos >= 0:
-            candidates.append(pos)
-
-    end = min(candidates) if candidates else len(page_text)
+    end = next((pos for pos, name in markers if name != label), len(page_text))
     return page_text[start:end].strip()
 
 
-def parse_cip_code(soup: BeautifulSoup, page_text: str) -> str:
-    candidates: List[str] = []
-
-    for selector in ["h1", "h2", "div.cipdetail h1", "div.cipdetail h2", "#cipHeader"]:
-        el = soup.select_one(selector)
-        if el:
-            candidates.append(el.get_text(" ", strip=True))
-
-    candidates.append(page_text)
+def parse_cip_code(page_text: str) -> str:
+    m = CIP_CAPTURE_RE.search(page_text)
+    return m.group(1).strip().rstrip(").,;:") if m else ""
 
-    for cand in candidates:
-        m = CIP_CAPTURE_RE.search(cand)
-        if m:
-            return m.group(1).strip().rstrip(").,;:")
 
-    return ""
+def page_text_from_html(html: str) -> str:
+    try:
+        doc = lxml.html.fromstring(html)
+    except etree.ParserError:
+        # empty / whitespace / comment-only page (e.g. truncated cache file): no text
+        return ""
+    etree.strip_elements(doc, "script", "style", "template", with_tail=False)
+    return "\n".join(t for t in (s.strip() for s in doc.itertext()) if t)
 
 
 def parse_illustrative_examples(page_text: str) -> List[str]:
-    if "Illustrative Examples" not in page_text:
-        return []
-
     ex_idx = page_text.find("Illustrative Examples")
-    window = page_text[ex_idx : ex_idx + 3000]
-
-    lines = [normalize_spaces(ln) for ln in window.split("\n") if normalize_spaces(ln)]
+    if ex_idx < 0:
+        return []
 
-    cleaned: List[str] = []
-    for ln in lines:
-        if ln in ("Illustrative Examples", "Help"):
+    examples: List[str] = []
+    for m in TEXT_LINE_RE.finditer(page_text, ex_idx, ex_idx + 3000):
+        ln = normalize_spaces(m.group())
+        if not ln or ln in ("Illustrative Examples", "Help"):
             continue
-        if ln.startswith("Browse") or ln.startswith("Crosswalk") or ln.startswith("Print"):
+        if ln.startswith(("Browse", "Crosswalk", "Print")):
             break
-        cleaned.append(ln)
-
-    if any("None available" in ln for ln in cleaned):
-        return []
+        if "None available" in ln:
+            return []
+        if len(ln) > 2:
+            examples.append(ln)
 
-    cleaned = [ln for ln in cleaned if len(ln) > 2 and ln not in ("Print",)]
-    return cleaned
+    return examples
 
 
 def parse_detail_html(html: str, url: str) -> Dict[str, Any]:
-    soup = BeautifulSoup(html, "html.parser")
-    page_text = soup.get_text("\n", strip=True)
+    page_text = page_text_from_html(html)
 
-    cip_raw = parse_cip_code(soup, page_text)
-    title = extract_section_text(page_text, "Title:")
-    definition = extract_section_text(page_text, "Definition:")
-    action = extract_section_text(page_text, "Action:")
+    cip_raw = parse_cip_code(page_text)
+    boundaries = find_section_boundaries(page_text)
+    title = extract_section_text(page_text, boundaries, "Title:")
+    definition = extract_section_text(page_text, boundaries, "Definition:")
+    action = extract_section_text(page_text, boundaries, "Action:")
     examples = parse_illustrative_examples(page_text)
 
     rec: Dict[str, Any] = {
@@ -189,30 +156,26 @@ def find_detail_url_for_target_cip(searchresults_html: str, target_cip: str) ->
     Parse searchresults.aspx and find the cipdetail link for the row whose CIP Code column matches target_cip.
     Matching uses canonical 4-decimal normalization.
     """
-    soup = BeautifulSoup(searchresults_html, "html.parser")
-    target_canon = canonical_cip(target_cip)
-
-    grid = soup.find("table", {"id": re.compile(r"GridView_searchresults")})
-    if not grid:
-        return None
-
-    rows = grid.find_all("tr")
-    if len(rows) < 2:
+    try:
+        doc = lxml.html.fromstring(searchresults_html)
+    except etree.ParserError:
+        # empty / comment-only page: no result rows
         return None
+    target_canon = canonical_cip(target_cip)
 
-    for tr in rows[1:]:
-        cip_td = tr.find("td", {"class": "cipcode"})
-        title_a = tr.select_one("span.CIPTitle a[href]")
+    # first row is the grid header
+    for tr in SEARCH_GRID_ROWS_XPATH(doc)[1:]:
+        cip_tds = ROW_CIP_XPATH(tr)
+        hrefs = ROW_TITLE_HREF_XPATH(tr)
 
-        if not cip_td or not title_a:
+        if not cip_tds or not hrefs:
             continue
 
-        row_cip_raw = normalize_spaces(cip_td.get_text(" ", strip=True))
+        row_cip_raw = normalize_spaces(" ".join(cip_tds[0].itertext()))
         row_canon = canonical_cip(row_cip_raw)
 
         if row_canon == target_canon:
-            href = title_a["href"]
-            abs_url = urljoin(BASE, href)
+            abs_url = urljoin(BASE, hrefs[0])
             qs = parse_qs(urlparse(abs_url).query)
             if qs.get("y", [""])[0] == "56" and qs.get("cipid", [""])[0].isdigit():
                 return abs_url
@@ -220,37 +183,69 @@ def find_detail_url_for_target_cip(searchresults_html: str, target_cip: str) ->
     return None
 
 
+def load_detail_for_cip(
+    limiter: RateLimiter,
+    search_cache: Path,
+    detail_cache: Path,
+    cip_canon: str,
+    cip: str,
+) -> Optional[Dict[str, Any]]:
+    """
+    Resolve a CIP to its cipdetail page via searchresults.aspx, then fetch + parse it.
+    The search uses the CIP as listed in the overlay; cache files + row matching use its canonical form.
+    Runs on the worker pool so parsing overlaps other requests in flight.
+    Returns None if no matching search-results row was found.
+    """
+    search_html = fetch_cached(
+        limiter, SEARCHRESULTS_URL.format(cip=cip), search_cache / f"searchresults_{cip_canon}.html"
+    )
+
+    detail_url = find_detail_url_for_target_cip(search_html, cip_canon)
+    if not detail_url:
+        return None
+
+    qs = parse_qs(urlparse(detail_url).query)
+    cipid = qs.get("cipid", [""])[0]
+    detail_html = fetch_cached(limiter, detail_url, detail_cache / f"cipdetail_{cipid}.html")
+    return parse_detail_html(detail_html, detail_url)
+
+
 def normalize_existing_nces_dataset(nces_doc: Dict[str, Any]) -> int:
     """
     Normalize ALL existing NCES records to canonical CIP format.
+    Records without a usable CIP are dropped, so afterwards every r["cip"] is canonical.
     Returns count of records changed.
     """
     records: List[Dict[str, Any]] = nces_doc.get("records", [])
     changed = 0
 
+    # single pass: normalize in place + de-dup by canonical cip (keep first)
+    dedup: Dict[str, Dict[str, Any]] = {}
     for r in records:
         raw = (r.get("cip") or "").strip()
         if not raw:
             continue
 
         canon = canonical_cip(raw)
-        if canon and canon != raw:
+        if not canon:
+            continue
+
+        if canon != raw:
             # preserve original display value for debugging
-            if "nces_display_cip" not in r:
-                r["nces_display_cip"] = raw
+            r.setdefault("nces_display_cip", raw)
             r["cip"] = canon
             changed += 1
 
-    # de-dup by canonical cip (keep first)
-    dedup: Dict[str, Dict[str, Any]] = {}
-    for r in records:
-        c = canonical_cip(r.get("cip", ""))
-        if not c:
-            continue
-        if c not in dedup:
-            dedup[c] = r
+        dedup.setdefault(canon, r)
+
+    bad_cip = [c for c in dedup if not CANON_CIP_RE.match(c)]
+    if bad_cip:
+        raise ValueError(
+            f"Non-canonical CIP in NCES dataset after normalization. "
+            f"Count={len(bad_cip)} Sample={bad_cip[:20]}"
+        )
 
-    nces_doc["records"] = sorted(dedup.values(), key=lambda x: (x.get("cip") or ""))
+    nces_doc["records"] = sorted(dedup.values(), key=itemgetter("cip"))
     nces_doc["record_count"] = len(nces_doc["records"])
     return changed
 
@@ -278,8 +273,14 @@ def main() -> None:
     overlay_records: List[Dict[str, Any]] = overlay.get("records", [])
     nces_records: List[Dict[str, Any]] = nces.get("records", [])
 
-    nces_by_canon = {canonical_cip(r.get("cip", "")): r for r in nces_records if r.get("cip")}
-    missing_cips = sorted([r["cip"] for r in overlay_records if r.get("missingInNcesSnapshot") is True])
+    # normalize_existing_nces_dataset guarantees r["cip"] is canonical
+    nces_by_canon = {r["cip"]: r for r in nces_records}
+    # (canonical, raw) pairs: canonicalized once here, one entry per canonical CIP
+    missing_cips = sorted(
+        {
+            canonical_cip(r["cip"]): r["cip"] for r in overlay_records if r.get("missingInNcesSnapshot") is True
+        }.items()
+    )
 
     if not missing_cips:
         print("No missing NCES records found. Nothing to backfill.")
@@ -287,58 +288,41 @@ def main() -> None:
 
     print(f"Missing NCES records to backfill: {len(missing_cips)}")
 
-    session = requests.Session()
-    session.headers.update({"User-Agent": "CIP-STEM-INTELLIGENCE (open-source) - educational use"})
-
     raw_dir = Path("data/raw/nces")
     search_cache = raw_dir / "searchresults_cache"
     detail_cache = raw_dir / "detail_cache_backfill"
     search_cache.mkdir(parents=True, exist_ok=True)
     detail_cache.mkdir(parents=True, exist_ok=True)
 
+    # fetch/cache + parse detail pages concurrently; matching happens below, in order
+    to_fetch = [(cip_canon, cip) for cip_canon, cip in missing_cips if cip_canon not in nces_by_canon]
+    limiter = RateLimiter(REQUEST_INTERVAL)
+    load = partial(load_detail_for_cip, limiter, search_cache, detail_cache)
+
+    parsed: Dict[str, Optional[Dict[str, Any]]] = {}
+
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+        results = pool.map(load, map(itemgetter(0), to_fetch), map(itemgetter(1), to_fetch))
+        for i, ((cip_canon, _), rec) in enumerate(zip(to_fetch, results), start=1):
+            parsed[cip_canon] = rec
+
+            if i % 10 == 0:
+                print(f"Backfill progress: {i}/{len(to_fetch)}")
+
     added = 0
     skipped = 0
     failed: List[str] = []
 
-    for i, cip in enumerate(missing_cips, start=1):
-        cip_canon = canonical_cip(cip)
-
+    for cip_canon, cip in missing_cips:
         if cip_canon in nces_by_canon:
             skipped += 1
             continue
 
-        # fetch/cache searchresults
-        search_path = search_cache / f"searchresults_{cip}.html"
-        if search_path.exists():
-            search_html = search_path.read_text(encoding="utf-8", errors="ignore")
-        else:
-            url = SEARCHRESULTS_URL.format(cip=cip)
-            r = session.get(url, timeout=60)
-            r.raise_for_status()
-            search_html = r.text
-            search_path.write_text(search_html, encoding="utf-8")
-            time.sleep(0.10)
-
-        detail_url = find_detail_url_for_target_cip(search_html, cip)
-        if not detail_url:
+        rec = parsed[cip_canon]
+        if rec is None:
             failed.append(cip)
             continue
 
-        qs = parse_qs(urlparse(detail_url).query)
-        cipid = qs.get("cipid", [""])[0]
-        detail_path = detail_cache / f"cipdetail_{cipid}.html"
-
-        if detail_path.exists():
-            detail_html = detail_path.read_text(encoding="utf-8", errors="ignore")
-        else:
-            r2 = session.get(detail_url, timeout=60)
-            r2.raise_for_status()
-            detail_html = r2.text
-            detail_path.write_text(detail_html, encoding="utf-8")
-            time.sleep(0.10)
-
-        rec = parse_detail_html(detail_html, detail_url)
-
         parsed_cip_raw = (rec.get("cip") or "").strip()
         parsed_canon = canonical_cip(parsed_cip_raw)
 
@@ -353,13 +337,11 @@ def main() -> None:
         nces_by_canon[cip_canon] = rec
         added += 1
 
-        if i % 10 == 0:
-            print(f"Backfill progress: {i}/{len(missing_cips)}")
-
     # write updated NCES dataset
-    nces["records"] = sorted(nces_records, key=lambda x: (x.get("cip") or ""))
-    nces["record_count"] = len(nces["records"])
-    write_json(nces_path, nces)
+    # every record carries a canonical "cip" by now (normalized above or set on append)
+    nces_records.sort(key=itemgetter("cip"))
+    nces["record_count"] = len(nces_records)
+    write_json(nces_path, nces, skip_unchanged=True)
 
     print(f"✅ Backfilled: {added}")
     print(f"⏭️  Skipped (already existed in NCES by canonical CIP): {skipped}")
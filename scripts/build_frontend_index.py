@@ -19,58 +19,29 @@
 from __future__ import annotations
 
 import hashlib
-import json
-import re
 from datetime import datetime, timezone
+from operator import itemgetter
 from pathlib import Path
 from typing import Any, Dict, List
 
+import orjson
 
-CANON_CIP_RE = re.compile(r"^\d{2}\.\d{4}$")
+from cip_codec import CANON_CIP_RE, canonical_cip
+from json_io import write_json
 
 
 def sha256_bytes(b: bytes) -> str:
     return hashlib.sha256(b).hexdigest()
 
 
-def load_json(path: Path) -> Any:
-    return json.loads(path.read_text(encoding="utf-8"))
-
-
-def canonical_cip(cip: str) -> str:
-    """
-    Convert CIP variants into canonical format: "XX.XXXX"
-    - "14"      -> "14.0000"
-    - "14.09"   -> "14.0900"
-    - "14.0903" -> "14.0903"
-    """
-    s = (cip or "").strip()
-    if not s:
-        return ""
+def sha256_file(path: Path) -> str:
+    # Streams the file through the hash (Python 3.11+) instead of reading it into memory
+    with path.open("rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
 
-    s = s.strip("[]()")  # safety for moved/deleted notations sometimes present in NCES outputs
 
-    if "." not in s:
-        if len(s) == 2 and s.isdigit():
-            return f"{s}.0000"
-        return s
-
-    left, right = s.split(".", 1)
-    left = left.strip()
-    right = right.strip()
-
-    if len(left) == 2 and left.isdigit() and right.isdigit():
-        # 4-digit rollup: "14.09"
-        if len(right) == 2:
-            return f"{left}.{right}00"
-        # 6-digit already: "14.0903"
-        if len(right) == 4:
-            return f"{left}.{right}"
-        # pad anything else up to 4
-        if 1 <= len(right) <= 4:
-            return f"{left}.{right.zfill(4)}"
-
-    return s
+def load_json(path: Path) -> Any:
+    return orjson.loads(path.read_bytes())
 
 
 def cip_family(cip_canon: str) -> str:
@@ -78,6 +49,34 @@ def cip_family(cip_canon: str) -> str:
     return cip_canon.split(".", 1)[0] if cip_canon else ""
 
 
+def to_index_record(r: Dict[str, Any], cip: str, _get=dict.get, _strip=str.strip) -> Dict[str, Any]:
+    """
+    Project one overlay record onto the index schema. `cip` is the already-validated canonical code.
+    dict.get / str.strip are bound as defaults so the per-field lookups in this hot loop stay local.
+    """
+    definition = _strip(_get(r, "definition") or "")
+    examples = _get(r, "illustrative_examples") or []
+
+    stem_eligible = _get(r, "stemEligible") is True
+
+    # Determine stem source (future-proofed):
+    # - Today: if stemEligible true, it comes from DHS (because the stem list is DHS)
+    # - Later: you may introduce other authorities; this field is intentionally explicit.
+    stem_source = "DHS" if stem_eligible else ""
+
+    return {
+        "cip": cip,
+        "cipFamily": cip_family(cip),
+        "cipYear": int(_get(r, "cipYear") or 2020),
+        "title": _strip(_get(r, "title") or ""),
+        "titleSource": _strip(_get(r, "titleSource") or "") or ("NCES" if definition else "Unknown"),
+        "stemEligible": stem_eligible,
+        "stemSource": stem_source,
+        "hasDefinition": bool(definition),
+        "hasIllustrativeExamples": bool(isinstance(examples, list) and len(examples) > 0),
+    }
+
+
 def main() -> None:
     overlay_path = Path("data/processed/cip_stem_overlay_latest.json")
     if not overlay_path.exists():
@@ -99,35 +98,12 @@ def main() -> None:
             bad_cip.append(cip_raw)
             continue
 
-        title = (r.get("title") or "").strip()
-        title_source = (r.get("titleSource") or "").strip()
-
-        stem_eligible = bool(r.get("stemEligible") is True)
+        row = to_index_record(r, cip)
 
-        # Determine stem source (future-proofed):
-        # - Today: if stemEligible true, it comes from DHS (because the stem list is DHS)
-        # - Later: you may introduce other authorities; this field is intentionally explicit.
-        stem_source = "DHS" if stem_eligible else ""
-
-        if stem_eligible and not stem_source:
+        if row["stemEligible"] and not row["stemSource"]:
             bad_stem_source.append(cip)
 
-        definition = (r.get("definition") or "").strip()
-        examples = r.get("illustrative_examples") or []
-
-        out_records.append(
-            {
-                "cip": cip,
-                "cipFamily": cip_family(cip),
-                "cipYear": int(r.get("cipYear") or 2020),
-                "title": title,
-                "titleSource": title_source or ("NCES" if definition else "Unknown"),
-                "stemEligible": stem_eligible,
-                "stemSource": stem_source,
-                "hasDefinition": bool(definition),
-                "hasIllustrativeExamples": bool(isinstance(examples, list) and len(examples) > 0),
-            }
-        )
+        out_records.append(row)
 
     if bad_cip:
         # show a few examples to make debugging fast
@@ -145,7 +121,7 @@ def main() -> None:
         )
 
     # Deterministic ordering
-    out_records.sort(key=lambda x: x["cip"])
+    out_records.sort(key=itemgetter("cip"))
 
     generated_utc = datetime.now(timezone.utc).isoformat()
 
@@ -155,28 +131,28 @@ def main() -> None:
             "generated_utc": generated_utc,
             "source_overlay_file": str(overlay_path).replace("\\", "/"),
             "record_count": len(out_records),
-            "stem_true_count": sum(1 for x in out_records if x.get("stemEligible") is True),
+            "stem_true_count": sum(1 for x in out_records if x["stemEligible"]),
             "cip_version": overlay.get("meta", {}).get("cip_version", "2020"),
         },
         "records": out_records,
     }
 
     out_path = Path("data/processed/cip_stem_index.json")
-    out_path.write_text(json.dumps(output, indent=2), encoding="utf-8")
+    payload = write_json(out_path, output)
 
-    digest = sha256_bytes(out_path.read_bytes())
+    digest = sha256_bytes(payload)
     manifest = {
         "file": str(out_path).replace("\\", "/"),
         "sha256": digest,
-        "bytes": out_path.stat().st_size,
+        "bytes": len(payload),
         "generated_utc": generated_utc,
         "record_count": output["meta"]["record_count"],
         "stem_true_count": output["meta"]["stem_true_count"],
-        "source_overlay_sha256": sha256_bytes(overlay_path.read_bytes()),
+        "source_overlay_sha256": sha256_file(overlay_path),
     }
 
     manifest_path = Path("data/processed/cip_stem_index.manifest.json")
-    manifest_path.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    write_json(manifest_path, manifest)
 
     print(f"Wrote: {out_path} ({output['meta']['record_count']} records)")
     print(f"SHA256: {digest}")
@@ -1,7 +1,8 @@
 """
 build_nces_cip2020.py
 - Reads NCES CIP 2020 detail-page URLs (y=56) extracted from the NCES browse page
-- Fetches each cipdetail page (with caching + polite throttling)
+- Fetches each cipdetail page (with caching + concurrent workers under a shared polite rate limit)
+- Caches each parsed record (data/raw/nces/parsed_cache/), reused while the page HTML is unchanged
 - Extracts:
   - CIP code (supports 2-digit, 4-digit, and 6-digit formats)
   - Title
@@ -20,21 +21,33 @@ Notes:
 from __future__ import annotations
 
 import hashlib
-import json
 import re
-import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from functools import partial
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Tuple
 from urllib.parse import parse_qs, urlparse
 
-import requests
-from bs4 import BeautifulSoup
+import lxml.html
+import orjson
+from lxml import etree
+
+from http_fetch import RateLimiter, fetch_cached
+from json_io import write_json
 
 
 BASE = "https://nces.ed.gov/ipeds/cipcode/"
 CIP2020_BROWSE_URL = "https://nces.ed.gov/ipeds/cipcode/browse.aspx?y=56"
 
+# Concurrent fetches share one global rate limit (~5 requests/sec) to stay polite
+FETCH_WORKERS = 8
+REQUEST_INTERVAL = 0.20
+
+# Parsed records are cached per page, keyed by cipid + a hash of the page HTML.
+# Bump the version whenever parse_detail_html's output changes so old parses are not reused.
+PARSED_CACHE_VERSION = 1
+
 
 # CIP formats we support:
 # - 2-digit:  01
@@ -42,19 +55,35 @@ CIP2020_BROWSE_URL = "https://nces.ed.gov/ipeds/cipcode/browse.aspx?y=56"
 # - 6-digit:  01.0000
 CIP_CAPTURE_RE = re.compile(r"Detail for CIP Code\s+(\d{2}(?:\.\d{2}(?:\d{2})?)?)")
 
+# Section labels on cipdetail pages; each one also acts as a "stop marker" for the others
+SECTION_LABELS = ["Title:", "Definition:", "Action:", "Illustrative Examples", "Crosswalk", "Browse", "Print"]
+SECTION_LABEL_RE = re.compile("|".join(re.escape(label) for label in SECTION_LABELS))
+
+# Non-empty lines of rendered page text
+TEXT_LINE_RE = re.compile(r"[^\n]+")
+
 
 def sha256_bytes(b: bytes) -> str:
     return hashlib.sha256(b).hexdigest()
 
 
 def normalize_spaces(s: str) -> str:
-    return re.sub(r"\s+", " ", s).strip()
+    # str.split() with no args splits on the same whitespace as r"\s+" and drops the ends
+    return " ".join(s.split())
+
+
+def find_section_boundaries(page_text: str) -> List[Tuple[int, str]]:
+    """
+    Offsets of every section label in the page text, found in a single regex pass.
+    """
+    return [(m.start(), m.group()) for m in SECTION_LABEL_RE.finditer(page_text)]
 
 
-def extract_section_text(page_text: str, label: str) -> str:
+def extract_section_text(page_text: str, boundaries: List[Tuple[int, str]], label: str) -> str:
     """
     Extracts the text after 'Label:' up to the next known section label.
-    Works against the page's rendered text output.
+    Works against the page's rendered text output, using the label offsets
+    from find_section_boundaries().
 
     Labels observed on NCES cipdetail pages:
       - Title:
@@ -62,109 +91,86 @@ def extract_section_text(page_text: str, label: str) -> str:
       - Action:
       - Illustrative Examples
     """
-    # Order matters: these become our "stop markers"
-    labels = ["Title:", "Definition:", "Action:", "Illustrative Examples", "Crosswalk", "Browse", "Print"]
+    markers = iter(boundaries)
 
-    start = page_text.find(label)
-    if start < 0:
+    for pos, name in markers:
+        if name == label:
+            start = pos + len(label)
+            break
+    else:
         return ""
 
-    start += len(label)
-
-    # Find the nearest next marker after this label
-    candidates: List[int] = []
-    for nxt in labels:
-        if nxt == label:
-            continue
-        pos = page_text.find(nxt, start)
-        if pos >= 0:
-            candidates.append(pos)
-
-    end = min(candidates) if candidates else len(page_text)
+    # Nearest following marker (other than the label itself) ends the section
+    end = next((pos for pos, name in markers if name != label), len(page_text))
     return page_text[start:end].strip()
 
 
-def parse_cip_code(soup: BeautifulSoup, page_text: str) -> str:
+def parse_cip_code(page_text: str) -> str:
     """
     Robust CIP extraction:
-    - Prefer structured header area if present
-    - Fallback to page_text search
+    - Searches the rendered page text for the "Detail for CIP Code ..." header
     - Supports 2/4/6 digit formats
     """
-    cip = ""
-
-    # Try common header containers first
-    # (NCES markup can change, so we keep this flexible)
-    header_candidates = []
-
-    # Common: a header element that includes "Detail for CIP Code ..."
-    for selector in [
-        "h1",
-        "h2",
-        "div.cipdetail h1",
-        "div.cipdetail h2",
-        "#cipHeader",
-    ]:
-        el = soup.select_one(selector)
-        if el:
-            header_candidates.append(el.get_text(" ", strip=True))
-
-    # Add a fallback candidate: entire page text
-    header_candidates.append(page_text)
-
-    for candidate in header_candidates:
-        m = CIP_CAPTURE_RE.search(candidate)
-        if m:
-            cip = m.group(1).strip()
-            break
+    m = CIP_CAPTURE_RE.search(page_text)
+    cip = m.group(1).strip() if m else ""
 
     # Safety cleanup for trailing punctuation
     return cip.rstrip(").,;:")
 
 
+def page_text_from_html(html: str) -> str:
+    """
+    Rendered page text, one stripped text node per line.
+    Script/style bodies are dropped so only visible text remains.
+    """
+    try:
+        doc = lxml.html.fromstring(html)
+    except etree.ParserError:
+        # empty / whitespace / comment-only page (e.g. truncated cache file): no text
+        return ""
+    etree.strip_elements(doc, "script", "style", "template", with_tail=False)
+    return "\n".join(t for t in (s.strip() for s in doc.itertext()) if t)
+
+
 def parse_illustrative_examples(page_text: str) -> List[str]:
     """
     Best-effort extraction of illustrative examples.
     NCES pages vary; sometimes examples are absent or show "None available".
     """
-    if "Illustrative Examples" not in page_text:
-        return []
-
-    # Grab a window after the section header
     ex_idx = page_text.find("Illustrative Examples")
-    window = page_text[ex_idx : ex_idx + 3000]
-
-    lines = [normalize_spaces(ln) for ln in window.split("\n") if normalize_spaces(ln)]
+    if ex_idx < 0:
+        return []
 
-    cleaned: List[str] = []
-    for ln in lines:
-        if ln in ("Illustrative Examples", "Help"):
+    # Scan a window after the section header in place (no slice / line list),
+    # normalizing and filtering each line, stopping at the first nav marker
+    examples: List[str] = []
+    for m in TEXT_LINE_RE.finditer(page_text, ex_idx, ex_idx + 3000):
+        ln = normalize_spaces(m.group())
+        if not ln or ln in ("Illustrative Examples", "Help"):
             continue
         # Stop if we hit a nav section
-        if ln.startswith("Browse") or ln.startswith("Crosswalk") or ln.startswith("Print"):
+        if ln.startswith(("Browse", "Crosswalk", "Print")):
             break
-        cleaned.append(ln)
+        # If the page says none are available, return empty list
+        if "None available" in ln:
+            return []
+        # Skip obvious non-example noise
+        if len(ln) > 2:
+            examples.append(ln)
 
-    # If the page says none are available, return empty list
-    if any("None available" in ln for ln in cleaned):
-        return []
-
-    # Remove obvious non-example noise
-    cleaned = [ln for ln in cleaned if len(ln) > 2 and ln not in ("Print",)]
-    return cleaned
+    return examples
 
 
 def parse_detail_html(html: str, url: str) -> Dict[str, Any]:
-    soup = BeautifulSoup(html, "html.parser")
-
     # Rendered text for section extraction
-    page_text = soup.get_text("\n", strip=True)
+    page_text = page_text_from_html(html)
 
-    cip = parse_cip_code(soup, page_text)
+    cip = parse_cip_code(page_text)
 
-    title = extract_section_text(page_text, "Title:")
-    definition = extract_section_text(page_text, "Definition:")
-    action = extract_section_text(page_text, "Action:")
+    boundaries = find_section_boundaries(page_text)
+    title = extract_section_text(page_text, boundaries, "Title:")
+    definition = extract_section_text(page_text, boundaries, "Definition:")
+    action = extract_section_text(page_text, boundaries, "Action:")
 
     examples = parse_illustrative_examples(page_text)
 
@@ -192,13 +198,43 @@ def get_cipid_from_url(url: str) -> str:
     return qs.get("cipid", [""])[0]
 
 
+def load_detail_record(
+    limiter: RateLimiter, cache_dir: Path, parsed_dir: Path, url: str
+) -> Dict[str, Any]:
+    cipid = get_cipid_from_url(url)
+    if not cipid.isdigit():
+        # If URL is malformed, skip but record the issue
+        return {
+            "cip": "",
+            "title": "",
+            "definition": "",
+            "action": "",
+            "illustrative_examples": [],
+            "source_url": url,
+            "parse_warning": True,
+            "error": "invalid_cipid_in_url",
+        }
+
+    html = fetch_cached(limiter, url, cache_dir / f"cipdetail_{cipid}.html")
+
+    # Unchanged HTML -> reuse the earlier parse instead of re-parsing
+    html_sha = sha256_bytes(html.encode("utf-8"))[:16]
+    parsed_path = parsed_dir / f"{cipid}_{html_sha}.json"
+    if parsed_path.exists():
+        return orjson.loads(parsed_path.read_bytes())
+
+    rec = parse_detail_html(html, url)
+    write_json(parsed_path, rec)
+    return rec
+
+
 def main() -> None:
     raw_dir = Path("data/raw/nces")
     urls_path = raw_dir / "nces_cip2020_detail_urls.json"
     if not urls_path.exists():
         raise FileNotFoundError("Missing detail URLs. Run extract_nces_detail_urls.py first.")
 
-    urls_doc = json.loads(urls_path.read_text(encoding="utf-8"))
+    urls_doc = orjson.loads(urls_path.read_bytes())
     urls: List[str] = urls_doc.get("urls", [])
     if not urls:
         raise ValueError("No NCES detail URLs found. Step 3 extraction likely failed.")
@@ -206,55 +242,26 @@ def main() -> None:
     out_dir = Path("data/processed")
     out_dir.mkdir(parents=True, exist_ok=True)
 
-    session = requests.Session()
-    session.headers.update(
-        {
-            "User-Agent": "CIP-STEM-INTELLIGENCE (open-source) - educational use",
-        }
-    )
-
     # Cache raw HTML for reproducibility / debugging
     cache_dir = raw_dir / "detail_cache"
     cache_dir.mkdir(parents=True, exist_ok=True)
 
-    records: List[Dict[str, Any]] = []
-
-    for i, url in enumerate(urls, start=1):
-        cipid = get_cipid_from_url(url)
-        if not cipid.isdigit():
-            # If URL is malformed, skip but record the issue
-            records.append(
-                {
-                    "cip": "",
-                    "title": "",
-                    "definition": "",
-                    "action": "",
-                    "illustrative_examples": [],
-                    "source_url": url,
-                    "parse_warning": True,
-                    "error": "invalid_cipid_in_url",
-                }
-            )
-            continue
+    parsed_dir = raw_dir / "parsed_cache" / f"v{PARSED_CACHE_VERSION}"
+    parsed_dir.mkdir(parents=True, exist_ok=True)
 
-        cache_path = cache_dir / f"cipdetail_{cipid}.html"
+    # Each worker fetches (or reads from cache) and parses one page, so parsing
+    # overlaps with requests still in flight. map() keeps browse-URL order.
+    limiter = RateLimiter(REQUEST_INTERVAL)
+    load = partial(load_detail_record, limiter, cache_dir, parsed_dir)
 
-        if cache_path.exists():
-            html = cache_path.read_text(encoding="utf-8", errors="ignore")
-        else:
-            r = session.get(url, timeout=60)
-            r.raise_for_status()
-            html = r.text
-            cache_path.write_text(html, encoding="utf-8")
-
-            # Polite throttling
-            time.sleep(0.10)
+    records: List[Dict[str, Any]] = []
 
-        rec = parse_detail_html(html, url)
-        records.append(rec)
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+        for i, rec in enumerate(pool.map(load, urls), start=1):
+            records.append(rec)
 
-        if i % 250 == 0:
-            print(f"Processed {i}/{len(urls)}")
+            if i % 250 == 0:
+                print(f"Processed {i}/{len(urls)}")
 
     dataset = {
         "source": {
@@ -269,19 +276,16 @@ def main() -> None:
     }
 
     out_path = out_dir / "nces_cip2020.json"
-    out_path.write_text(json.dumps(dataset, indent=2), encoding="utf-8")
-
-    digest = sha256_bytes(out_path.read_bytes())
-    (out_dir / "nces_cip2020.manifest.json").write_text(
-        json.dumps(
-            {
-                "file": str(out_path).replace("\\", "/"),
-                "sha256": digest,
-                "bytes": out_path.stat().st_size,
-            },
-            indent=2,
-        ),
-        encoding="utf-8",
+    payload = write_json(out_path, dataset)
+
+    digest = sha256_bytes(payload)
+    write_json(
+        out_dir / "nces_cip2020.manifest.json",
+        {
+            "file": str(out_path).replace("\\", "/"),
+            "sha256": digest,
+            "bytes": len(payload),
+        },
     )
 
     print(f"Wrote: {out_path} ({len(records)} records)")
@@ -24,59 +24,23 @@
 from __future__ import annotations
 
 import hashlib
-import json
-import re
+from collections import defaultdict
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any, Dict, List
 
+import orjson
+
+from cip_codec import canonical_cip
+from json_io import write_json
+
 
 def sha256_bytes(b: bytes) -> str:
     return hashlib.sha256(b).hexdigest()
 
 
 def load_json(path: Path) -> Any:
-    return json.loads(path.read_text(encoding="utf-8"))
-
-
-def canonical_cip(cip: str) -> str:
-    """
-    Convert CIP variants into canonical XX.XXXX format:
-    - 2-digit: "14"      -> "14.0000"
-    - 4-digit: "14.09"   -> "14.0900"
-    - 6-digit: "14.0903" -> "14.0903"
-    Also removes bracket/paren wrappers sometimes used by NCES for moved/deleted codes.
-    """
-    s = (cip or "").strip()
-    if not s:
-        return ""
-
-    # Remove wrappers like [14.0901] or (14.0901)
-    s = s.strip("[]()").strip()
-
-    if "." not in s:
-        # 2-digit family
-        if len(s) == 2 and s.isdigit():
-            return f"{s}.0000"
-        return s
-
-    left, right = s.split(".", 1)
-    left = left.strip()
-    right = right.strip()
-
-    # If right has 2 digits => 4-digit rollup (e.g., 14.09 -> 14.0900)
-    if len(left) == 2 and left.isdigit() and len(right) == 2 and right.isdigit():
-        return f"{left}.{right}00"
-
-    # If right has 4 digits => already 6-digit program code (e.g., 14.0903)
-    if len(left) == 2 and left.isdigit() and len(right) == 4 and right.isdigit():
-        return f"{left}.{right}"
-
-    # If right is 1-4 digits, pad to 4 to be safe
-    if len(left) == 2 and left.isdigit() and right.isdigit() and 1 <= len(right) <= 4:
-        return f"{left}.{right.zfill(4)}"
-
-    return s
+    return orjson.loads(path.read_bytes())
 
 
 def pick_first_nonempty(*vals: str) -> str:
@@ -86,6 +50,10 @@ def pick_first_nonempty(*vals: str) -> str:
     return ""
 
 
+def completeness_score(r: Dict[str, Any]) -> int:
+    return int(bool(r.get("title"))) + int(bool(r.get("definition")))
+
+
 def main() -> None:
     nces_path = Path("data/processed/nces_cip2020.json")
     dhs_path = Path("data/processed/stem_dhs_latest.json")
@@ -108,51 +76,64 @@ def main() -> None:
     # -----------------------------
     # Index NCES by canonical CIP
     # -----------------------------
-    nces_by_cip: Dict[str, Dict[str, Any]] = {}
+    # Group by canonical CIP first, then keep the most complete record per CIP
+    # (one with title/definition); on a tie the first one seen wins.
+    nces_groups: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
     for r in nces_records:
-        raw = (r.get("cip") or "").strip()
-        cip = canonical_cip(raw)
-        if not cip:
-            continue
-
-        # Normalize the record CIP in-memory so overlay output is consistent
-        r_canon = dict(r)
-        r_canon["cip"] = cip
+        cip = canonical_cip(r.get("cip") or "")
+        if cip:
+            nces_groups[cip].append(r)
 
-        # If duplicates exist, prefer the one with a definition/title (more complete)
-        existing = nces_by_cip.get(cip)
-        if not existing:
-            nces_by_cip[cip] = r_canon
-        else:
-            existing_score = int(bool(existing.get("title"))) + int(bool(existing.get("definition")))
-            new_score = int(bool(r_canon.get("title"))) + int(bool(r_canon.get("definition")))
-            if new_score > existing_score:
-                nces_by_cip[cip] = r_canon
+    # Records are used as-is (no copy): the overlay takes its CIP from the canonical key,
+    # never from the record's own raw "cip"
+    nces_by_cip: Dict[str, Dict[str, Any]] = {
+        cip: max(rs, key=completeness_score) for cip, rs in nces_groups.items()
+    }
 
     # -----------------------------
     # DHS STEM set (canonical) + title fallback map
     # -----------------------------
-    stem_set = set()
-    dhs_title_by_cip: Dict[str, str] = {}
+    # canonical_cip is memoized, so canonicalizing in both passes costs one probe each
+    stem_set = frozenset(cip for cip in (canonical_cip(r.get("cip") or "") for r in dhs_records) if cip)
 
+    dhs_title_by_cip: Dict[str, str] = {}
     for r in dhs_records:
-        raw = (r.get("cip") or "").strip()
-        cip = canonical_cip(raw)
+        cip = canonical_cip(r.get("cip") or "")
         title = (r.get("title_from_pdf") or "").strip()
 
-        if cip:
-            stem_set.add(cip)
-
         # Keep first non-empty title encountered for that CIP
         if cip and title and cip not in dhs_title_by_cip:
             dhs_title_by_cip[cip] = title
 
     # -----------------------------
-    # Build overlay (NCES as the base)
+    # Build overlay: outer merge of NCES + DHS on canonical CIP.
+    # Keys are visited in sorted order, so records come out stable for diffs.
     # -----------------------------
     overlay_records: List[Dict[str, Any]] = []
+    missing_stem = 0
+
+    for cip in sorted(nces_by_cip.keys() | stem_set):
+        r = nces_by_cip.get(cip)
+
+        # “Orphan STEM code”: DHS CIP missing in NCES snapshot
+        if r is None:
+            missing_stem += 1
+            overlay_records.append(
+                {
+                    "cip": cip,
+                    "cipYear": 2020,
+                    "title": dhs_title_by_cip.get(cip, ""),
+                    "definition": "",
+                    "action": "",
+                    "illustrative_examples": [],
+                    "stemEligible": True,
+                    "ncesSourceUrl": "",
+                    "missingInNcesSnapshot": True,
+                    "titleSource": "DHS PDF (fallback)",
+                }
+            )
+            continue
 
-    for cip, r in nces_by_cip.items():
         overlay_records.append(
             {
                 "cip": cip,
@@ -167,28 +148,6 @@ def main() -> None:
             }
         )
 
-    # Add “orphan STEM codes” if any DHS CIP is missing in NCES snapshot
-    missing_stem = sorted([c for c in stem_set if c not in nces_by_cip])
-
-    for cip in missing_stem:
-        overlay_records.append(
-            {
-                "cip": cip,
-                "cipYear": 2020,
-                "title": dhs_title_by_cip.get(cip, ""),
-                "definition": "",
-                "action": "",
-                "illustrative_examples": [],
-                "stemEligible": True,
-                "ncesSourceUrl": "",
-                "missingInNcesSnapshot": True,
-                "titleSource": "DHS PDF (fallback)",
-            }
-        )
-
-    # Stable ordering for diffs
-    overlay_records = sorted(overlay_records, key=lambda x: x.get("cip", ""))
-
     output = {
         "meta": {
             "name": "CIP STEM Intelligence Overlay",
@@ -197,7 +156,7 @@ def main() -> None:
             "nces_record_count": len(nces_by_cip),
             "dhs_stem_record_count": len(stem_set),
             "overlay_record_count": len(overlay_records),
-            "missing_stem_in_nces_snapshot": len(missing_stem),
+            "missing_stem_in_nces_snapshot": missing_stem,
         },
         "sources": {
             "nces": nces.get("source", {}),
@@ -214,24 +173,23 @@ def main() -> None:
     }
 
     out_path = Path("data/processed/cip_stem_overlay_latest.json")
-    out_path.write_text(json.dumps(output, indent=2), encoding="utf-8")
+    # Hash the serialized payload in hand rather than reading the file back
+    payload = write_json(out_path, output)
 
-    digest = sha256_bytes(out_path.read_bytes())
+    digest = sha256_bytes(payload)
     manifest = {
         "file": str(out_path).replace("\\", "/"),
         "sha256": digest,
-        "bytes": out_path.stat().st_size,
+        "bytes": len(payload),
         "generated_utc": output["meta"]["generated_utc"],
         "missing_stem_in_nces_snapshot": output["meta"]["missing_stem_in_nces_snapshot"],
     }
 
-    (Path("data/processed/cip_stem_overlay_latest.manifest.json")).write_text(
-        json.dumps(manifest, indent=2), encoding="utf-8"
-    )
+    write_json(Path("data/processed/cip_stem_overlay_latest.manifest.json"), manifest)
 
     print(f"Wrote: {out_path} ({len(overlay_records)} records)")
     print(f"SHA256: {digest}")
-    print(f"Missing STEM codes in NCES snapshot: {len(missing_stem)}")
+    print(f"Missing STEM codes in NCES snapshot: {missing_stem}")
 
 
 if __name__ == "__main__":
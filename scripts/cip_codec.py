@@ -0,0 +1,55 @@
+"""
+cip_codec.py
+- Shared CIP code handling for the pipeline scripts:
+  - canonical_cip: normalize CIP variants (NCES/DHS) to canonical "XX.XXXX"
+  - CANON_CIP_RE: validates the canonical format
+  - CIP_SCAN_RE: finds 6-digit CIP codes in free text (DHS PDF lines)
+- Imported by the other scripts (`python scripts/<name>.py` puts scripts/ on sys.path)
+"""
+
+from __future__ import annotations
+
+import functools
+import re
+
+
+# Canonical CIP: "14.0903"
+CANON_CIP_RE = re.compile(r"^\d{2}\.\d{4}$")
+
+# 6-digit CIP code anywhere in a line of text
+CIP_SCAN_RE = re.compile(r"\b(\d{2}\.\d{4})\b")
+
+# Cleaned CIP split into family + optional decimal part: "14", "14.09", "14.0903".
+# Whitespace is tolerated only around the dot, never inside the digit groups.
+CIP_PARTS_RE = re.compile(r"(\d{2})(?:\s*\.\s*(\d{1,4}))?")
+
+
+@functools.lru_cache(maxsize=None)
+def canonical_cip(cip: str) -> str:
+    """
+    Convert CIP variants into canonical XX.XXXX format:
+    - 2-digit: "14"      -> "14.0000"
+    - 4-digit: "14.09"   -> "14.0900"
+    - 6-digit: "14.0903" -> "14.0903"
+    Also drops surrounding whitespace and bracket/paren wrappers sometimes used by NCES for moved/deleted codes.
+    Anything that is not CIP-shaped is returned cleaned but otherwise unchanged.
+    Memoized: the same raw strings recur across the NCES and DHS inputs.
+    """
+    s = (cip or "").strip().strip("[]()").strip()
+
+    m = CIP_PARTS_RE.fullmatch(s)
+    if not m:
+        return s
+
+    left, right = m.groups()
+
+    # 2-digit family
+    if right is None:
+        return f"{left}.0000"
+
+    # 4-digit rollup (e.g., 14.09 -> 14.0900)
+    if len(right) == 2:
+        return f"{left}.{right}00"
+
+    # 6-digit program code as-is; any other 1-4 digit right part is padded to 4 to be safe
+    return f"{left}.{right.zfill(4)}"
@@ -10,12 +10,12 @@ extract_nces_detail_urls.py
 
 from __future__ import annotations
 
-import json
 from pathlib import Path
-from urllib.parse import urljoin, urlparse, parse_qs, urlencode, urlunparse
+from urllib.parse import quote_plus, unquote_plus, urljoin, urlparse, urlunparse
 
-from bs4 import BeautifulSoup
+import lxml.html
 
+from json_io import write_json
 
 BASE = "https://nces.ed.gov/ipeds/cipcode/"
 
@@ -24,29 +24,34 @@ def normalize_detail_url(href: str) -> str | None:
     """
     Normalize href into a canonical absolute URL:
       https://nces.ed.gov/ipeds/cipcode/cipdetail.aspx?y=56&cipid=XXXX
-    Returns None if href is not a cipdetail link for y=56 with a cipid.
+    Returns None if href is not a cipdetail.aspx link with y=56 and a numeric cipid.
     """
     if not href:
         return None
 
-    if "cipdetail.aspx" not in href.lower():
-        return None
-
     abs_url = urljoin(BASE, href)
 
     u = urlparse(abs_url)
-    qs = parse_qs(u.query)
+    if not u.path.lower().endswith("/cipdetail.aspx"):
+        return None
+
+    # First value per param, split by hand (same rules as parse_qs: blank values skipped)
+    params: dict[str, str] = {}
+    for pair in u.query.split("&"):
+        name, sep, value = pair.partition("=")
+        if sep and value:
+            params.setdefault(unquote_plus(name), unquote_plus(value))
 
     # Must be CIP 2020 for this milestone
-    if qs.get("y", [""])[0] != "56":
+    if params.get("y") != "56":
         return None
 
-    cipid = qs.get("cipid", [""])[0]
+    cipid = params.get("cipid", "")
     if not cipid.isdigit():
         return None
 
     # Canonicalize ordering (y then cipid)
-    canonical_qs = urlencode({"y": "56", "cipid": cipid})
+    canonical_qs = f"y=56&cipid={quote_plus(cipid)}"
     canonical = urlunparse((u.scheme, u.netloc, u.path, "", canonical_qs, ""))
 
     return canonical
@@ -59,12 +64,15 @@ def main() -> None:
         raise FileNotFoundError("Missing browse HTML. Run fetch_nces_index.py first.")
 
     html = html_path.read_text(encoding="utf-8", errors="ignore")
-    soup = BeautifulSoup(html, "html.parser")
+    doc = lxml.html.fromstring(html)
 
     urls = set()
 
-    for a in soup.find_all("a", href=True):
-        href = a.get("href")
+    # href values come back entity-decoded (&amp; -> &)
+    for href in doc.xpath("//a/@href"):
+        # Cheap substring test first; only cipdetail links are worth URL-parsing
+        if "cipdetail.aspx" not in href.lower():
+            continue
         norm = normalize_detail_url(href)
         if norm:
             urls.add(norm)
@@ -72,10 +80,7 @@ def main() -> None:
     urls_list = sorted(urls)
 
     out_path = raw_dir / "nces_cip2020_detail_urls.json"
-    out_path.write_text(
-        json.dumps({"count": len(urls_list), "urls": urls_list}, indent=2),
-        encoding="utf-8",
-    )
+    write_json(out_path, {"count": len(urls_list), "urls": urls_list})
 
     print(f"Wrote: {out_path} ({len(urls_list)} URLs)")
 
@@ -0,0 +1,116 @@
+"""
+http_fetch.py
+- Shared HTTP helpers for the fetch/build scripts:
+  - download: stream one file (DHS PDF, NCES browse page) to disk with its sha256 + size
+  - make_session / thread_session: keep-alive session with retries, one per worker thread
+  - RateLimiter: one polite request rate shared by all worker threads
+  - fetch_cached: fetch a page through an on-disk HTML cache
+- Imported by the other scripts (`python scripts/<name>.py` puts scripts/ on sys.path)
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def download(url: str, path: Path) -> Tuple[str, str, int]:
+    """
+    Streams the response body to disk, hashing it chunk by chunk, so the body
+    is never held in memory. Writes via a temp file so a failed download
+    leaves any previous copy intact (and no partial temp file behind).
+    Returns (final_url, sha256, bytes).
+    """
+    h = hashlib.sha256()
+    size = 0
+    tmp_path = path.with_name(path.name + ".tmp")
+
+    try:
+        with requests.get(url, allow_redirects=True, timeout=60, stream=True) as r:
+            r.raise_for_status()
+            with tmp_path.open("wb") as f:
+                for chunk in r.iter_content(chunk_size=1 << 16):
+                    h.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            final_url = r.url
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    return final_url, h.hexdigest(), size
+
+
+def make_session() -> requests.Session:
+    """
+    Keep-alive session for nces.ed.gov requests (one per worker thread, see thread_session).
+    Transient failures (429/5xx, dropped connections) are retried with backoff.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=1,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]),
+    )
+    session.mount("https://", adapter)
+    session.headers.update(
+        {
+            "User-Agent": "CIP-STEM-INTELLIGENCE (open-source) - educational use",
+            "Connection": "keep-alive",
+        }
+    )
+    return session
+
+
+# Each worker thread lazily gets its own session, so threads never contend on a shared pool
+thread_state = threading.local()
+
+
+def thread_session() -> requests.Session:
+    session = getattr(thread_state, "session", None)
+    if session is None:
+        session = thread_state.session = make_session()
+    return session
+
+
+class RateLimiter:
+    """
+    Spaces request start times at least `interval` seconds apart across all threads.
+    """
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def fetch_cached(limiter: RateLimiter, url: str, cache_path: Path) -> str:
+    """
+    Return the cached HTML for url, or fetch it (under the rate limit) and cache it.
+    """
+    if cache_path.exists():
+        return cache_path.read_text(encoding="utf-8", errors="ignore")
+
+    limiter.wait()
+    r = thread_session().get(url, timeout=60)
+    r.raise_for_status()
+    html = r.text
+    cache_path.write_text(html, encoding="utf-8")
+    return html
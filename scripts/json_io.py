@@ -0,0 +1,31 @@
+"""
+json_io.py
+- Shared JSON output helper for the pipeline scripts:
+  - write_json: 2-space indented orjson, written to a temp file and swapped in atomically
+- Imported by the other scripts (`python scripts/<name>.py` puts scripts/ on sys.path)
+"""
+
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Any
+
+import orjson
+
+
+def write_json(path: Path, obj: Any, skip_unchanged: bool = False) -> bytes:
+    """
+    Serialize with 2-space indentation; a temp file + rename means a crash never leaves a half-written file.
+    skip_unchanged leaves an identical existing file (and its mtime) alone. Only worth it for outputs
+    without generated_utc, which would otherwise differ on every run.
+    Returns the serialized bytes so callers can hash them without re-reading the file.
+    """
+    payload = orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    if skip_unchanged and path.exists() and path.stat().st_size == len(payload) and path.read_bytes() == payload:
+        return payload
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_bytes(payload)
+    os.replace(tmp_path, path)
+    return payload
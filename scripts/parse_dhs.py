@@ -14,15 +14,18 @@ Notes:
 from __future__ import annotations
 
 import json
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
+from itertools import repeat
+from operator import attrgetter
 from pathlib import Path
 from typing import Iterable, List, Optional, Tuple
 
 import pdfplumber
 
-
-CIP_RE = re.compile(r"\b(\d{2}\.\d{4})\b")
+from cip_codec import CIP_SCAN_RE
 
 
 @dataclass(frozen=True)
@@ -35,10 +38,11 @@ def normalize_spaces(s: str) -> str:
     return re.sub(r"\s+", " ", s).strip()
 
 
-def extract_lines(pdf_path: Path) -> List[str]:
+def extract_page_range_lines(pdf_path: Path, start: int, stop: int) -> List[str]:
+    # Runs in a worker process: each opens its own handle (pdfplumber objects don't pickle)
     lines: List[str] = []
     with pdfplumber.open(str(pdf_path)) as pdf:
-        for page in pdf.pages:
+        for page in pdf.pages[start:stop]:
             text = page.extract_text() or ""
             for line in text.splitlines():
                 line = normalize_spaces(line)
@@ -47,6 +51,25 @@ def extract_lines(pdf_path: Path) -> List[str]:
     return lines
 
 
+def extract_lines(pdf_path: Path) -> List[str]:
+    """
+    Page text extraction is CPU-bound, so contiguous page ranges are spread
+    across processes; map() keeps them in page order.
+    """
+    with pdfplumber.open(str(pdf_path)) as pdf:
+        page_count = len(pdf.pages)
+
+    workers = min(os.cpu_count() or 1, page_count)
+    if workers <= 1:
+        return extract_page_range_lines(pdf_path, 0, page_count)
+
+    step = -(-page_count // workers)
+    starts = range(0, page_count, step)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunks = pool.map(extract_page_range_lines, repeat(pdf_path), starts, [s + step for s in starts])
+        return [line for chunk in chunks for line in chunk]
+
+
 def parse_cip_lines(lines: Iterable[str]) -> List[StemCipRow]:
     """
     Heuristic:
@@ -55,28 +78,36 @@ def parse_cip_lines(lines: Iterable[str]) -> List[StemCipRow]:
     - If remainder is too short, try the next line as title continuation
     """
     rows: List[StemCipRow] = []
-    lines_list = list(lines)
 
-    for i, line in enumerate(lines_list):
-        m = CIP_RE.search(line)
+    # One regex scan over the joined text; only the first CIP on each line counts
+    text = "\n".join(lines)
+    pos = 0
+
+    while True:
+        m = CIP_SCAN_RE.search(text, pos)
         if not m:
-            continue
+            break
 
         cip = m.group(1)
 
-        # Try to get title from the same line after the CIP
-        after = normalize_spaces(line[m.end() :])
-        title = after
+        line_end = text.find("\n", m.end())
+        if line_end < 0:
+            line_end = len(text)
+
+        # Try to get title from the same line after the CIP (lines are already normalized)
+        title = text[m.end() : line_end].strip()
 
         # If title is empty or suspiciously tiny, look at next line
-        if len(title) < 3 and i + 1 < len(lines_list):
-            title = normalize_spaces(lines_list[i + 1])
+        if len(title) < 3 and line_end < len(text):
+            next_end = text.find("\n", line_end + 1)
+            title = text[line_end + 1 : next_end if next_end >= 0 else len(text)]
 
         # Guardrails: avoid headers/footers/noise
         if not title or title.lower().startswith(("page ", "department of homeland", "stem designated")):
             title = ""
 
         rows.append(StemCipRow(cip=cip, title=title))
+        pos = line_end + 1
 
     # Deduplicate by CIP (keep first non-empty title if possible)
     by_cip: dict[str, StemCipRow] = {}
@@ -89,7 +120,7 @@ def parse_cip_lines(lines: Iterable[str]) -> List[StemCipRow]:
                 by_cip[row.cip] = row
 
     # Sort for stable diffs
-    return sorted(by_cip.values(), key=lambda x: x.cip)
+    return sorted(by_cip.values(), key=attrgetter("cip"))
 
 
 def main() -> None:
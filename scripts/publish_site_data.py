@@ -9,15 +9,46 @@
 
 from __future__ import annotations
 
+import os
 import shutil
 from pathlib import Path
 
 
+def copy_range(src: Path, dst: Path) -> bool:
+    """
+    Kernel-side copy via copy_file_range (Linux): no userspace buffer, and a
+    metadata-only reflink on filesystems that support it (Btrfs/XFS).
+    Returns False if the platform or filesystem can't do it.
+    """
+    if not hasattr(os, "copy_file_range"):
+        return False
+    try:
+        with src.open("rb") as fsrc, dst.open("wb") as fdst:
+            remaining = os.fstat(fsrc.fileno()).st_size
+            while remaining > 0:
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        return remaining == 0
+    except OSError:
+        return False
+
+
 def copy_file(src: Path, dst: Path) -> None:
     if not src.exists():
         raise FileNotFoundError(f"Missing source file: {src}")
+    # Same file (e.g. docs/data/processed symlinked to data/processed): opening dst
+    # for writing would truncate the source, so refuse like copy2 did
+    if dst.exists() and src.samefile(dst):
+        raise shutil.SameFileError(f"{src} and {dst} are the same file")
     dst.parent.mkdir(parents=True, exist_ok=True)
-    shutil.copy2(src, dst)
+    if not copy_range(src, dst):
+        shutil.copyfile(src, dst)
+    # Keep the source mode + timestamps (what copy2 preserved)
+    shutil.copymode(src, dst)
+    st = src.stat()
+    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
 
 
 def main() -> None:
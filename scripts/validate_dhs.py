@@ -8,10 +8,11 @@ validate_dhs.py
 
 from __future__ import annotations
 
-import json
 import re
 from pathlib import Path
 
+import orjson
+
 
 CIP_RE = re.compile(r"^\d{2}\.\d{4}$")
 
@@ -21,7 +22,7 @@ def main() -> None:
     if not p.exists():
         raise FileNotFoundError("Run parse_dhs.py first.")
 
-    data = json.loads(p.read_text(encoding="utf-8"))
+    data = orjson.loads(p.read_bytes())
     records = data.get("records", [])
 
     if not records:
@@ -11,10 +11,11 @@
 
 from __future__ import annotations
 
-import json
 import re
 from pathlib import Path
 
+import orjson
+
 
 CIP_RE = re.compile(r"^\d{2}(?:\.\d{2}(?:\d{2})?)?$")
 
@@ -24,7 +25,7 @@ def main() -> None:
     if not p.exists():
         raise FileNotFoundError("Run build_overlay.py first.")
 
-    data = json.loads(p.read_text(encoding="utf-8"))
+    data = orjson.loads(p.read_bytes())
     records = data.get("records", [])
     meta = data.get("meta", {})
 